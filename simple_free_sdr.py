@@ -27,27 +27,90 @@ Requirements:
 import os
 import asyncio
 import json
-import smtplib
-import imaplib
 import email
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import email.policy
+from email import quoprimime
+from email.header import Header
+from email.utils import formataddr, parseaddr
+import sqlite3
+import time
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
-from threading import Thread
-import time
+from aiolimiter import AsyncLimiter
+import aiosmtplib
+from imapclient import IMAPClient, SEEN
+from fastapi import BackgroundTasks, FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
 
 # Import OpenAI for direct API calls (simpler than agents framework)
 import openai
 
 
+# Campaign throughput: recipients drafted in parallel and pooled SMTP sessions
+CAMPAIGN_CONCURRENCY = 8
+SMTP_POOL_SIZE = 4
+
+# Send-rate limits ("messages/seconds") per SMTP host; SMTP_RATE overrides
+SMTP_RATE_DEFAULTS = {
+    "smtp-mail.outlook.com": "30/60",
+    "smtp.office365.com": "30/60",
+}
+DEFAULT_SMTP_RATE = "20/60"
+
+# Re-issue IMAP IDLE before servers drop it (RFC 2177 allows 30 minutes)
+IMAP_IDLE_TIMEOUT = 29 * 60
+
+# Poll interval for IMAP servers that don't support IDLE
+IMAP_POLL_INTERVAL = 60
+
+# Conversations kept before the least recently active is dropped
+MAX_CONVERSATIONS = 10000
+
+# Structured output for the campaign's pitch-and-select call
+CAMPAIGN_PITCH_SCHEMA = {
+    "name": "campaign_pitches",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "pitches": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "persona": {"type": "string"},
+                        "angle": {"type": "string"},
+                        "hook": {"type": "string"}
+                    },
+                    "required": ["persona", "angle", "hook"],
+                    "additionalProperties": False
+                }
+            },
+            "best_index": {"type": "integer"},
+            "subject": {"type": "string"}
+        },
+        "required": ["pitches", "best_index", "subject"],
+        "additionalProperties": False
+    }
+}
+
+
 class SimpleSDR:
     """
     Simple SDR system using free services for email outreach and reply handling.
     """
     
+    # Writing style for each cold email persona
+    PERSONAS = {
+        "professional": "Write a professional, formal cold sales email",
+        "engaging": "Write a witty, engaging cold sales email that's likely to get a response",
+        "concise": "Write a brief, direct cold sales email that gets straight to the point"
+    }
+    
     def __init__(self):
         """Initialize with free email service configuration."""
         print("🤖 Initializing Simple Free AI SDR System...")
@@ -58,7 +121,23 @@ class SimpleSDR:
         if not os.environ.get('OPENAI_API_KEY'):
             raise ValueError("❌ OPENAI_API_KEY required - get free tier at https://platform.openai.com")
         
-        openai.api_key = os.environ.get('OPENAI_API_KEY')
+        # One async client for the whole process so every call shares its
+        # underlying HTTP connection pool instead of blocking the event loop
+        self.aclient = openai.AsyncOpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+        
+        # Optional local OpenAI-compatible server (e.g. vLLM) for drafting
+        draft_base_url = os.environ.get('DRAFT_BASE_URL')
+        if draft_base_url:
+            self.draft_client = openai.AsyncOpenAI(
+                base_url=draft_base_url,
+                api_key=os.environ.get('DRAFT_API_KEY', 'EMPTY')
+            )
+            self.draft_model = os.environ.get('DRAFT_MODEL', 'meta-llama/Llama-3.1-8B-Instruct')
+            self.draft_sampling = {"top_p": 0.9, "extra_body": {"top_k": 50}}
+        else:
+            self.draft_client = self.aclient
+            self.draft_model = "gpt-4o-mini"  # Cheaper than gpt-3.5-turbo
+            self.draft_sampling = {}
         
         # Email configuration - UPDATE THESE
         self.email_address = os.environ.get('EMAIL_ADDRESS', 'your-email@gmail.com')
@@ -67,95 +146,256 @@ class SimpleSDR:
         self.smtp_port = int(os.environ.get('SMTP_PORT', '587'))
         self.imap_server = os.environ.get('IMAP_SERVER', 'imap.gmail.com')
         
+        # Token bucket for all sends from this process, sized to the provider's
+        # quota (each webhook worker and the monitor process has its own)
+        smtp_rate = os.environ.get('SMTP_RATE') or SMTP_RATE_DEFAULTS.get(self.smtp_server, DEFAULT_SMTP_RATE)
+        try:
+            max_sends, period = (float(n) for n in smtp_rate.split('/'))
+            # AsyncLimiter can't acquire a whole send with capacity below 1
+            if not (1 <= max_sends < float('inf') and 0 < period < float('inf')):
+                raise ValueError(smtp_rate)
+        except ValueError:
+            raise ValueError(f"❌ SMTP_RATE must look like 500/3600 (at least 1 message per positive number of seconds), got {smtp_rate!r}") from None
+        self.send_limiter = AsyncLimiter(max_sends, period)
+        
         # Company info
         self.company_name = "ComplAI"
         self.company_description = "AI-powered SOC2 compliance automation"
         
-        # Conversation memory
-        self.conversations = {}
+        # System prompts only depend on company info, so build them once;
+        # only the short user message varies per call
+        persona_lines = "\n".join(f"- {name}: {style}" for name, style in self.PERSONAS.items())
+        shared_prompt = (
+            f"You are a sales development representative for {self.company_name}, "
+            f"which provides {self.company_description}.\n\n"
+            f"Persona styles:\n{persona_lines}\n\n"
+            "Don't invent statistics, customer results or other claims about the product."
+        )
+        self._pitch_system_prompt = (
+            f"{shared_prompt}\n\n"
+            "Task: for each persona you are given, outline a cold sales email as a "
+            "pitch: an angle (a few words) and a hook (one sentence, under 20 words).\n\n"
+            "Then pick the pitch a busy executive would be most likely to respond to "
+            "(best_index, 0-based, in the order given) and write a compelling subject "
+            "line for it that is likely to get opened. Under 50 characters."
+        )
+        self._expand_system_prompt = (
+            f"{shared_prompt}\n\n"
+            "Task: expand the pitch you are given into a full cold sales email in its "
+            "persona style. Make it compelling and personalized. Include a clear call "
+            "to action. Keep it under 150 words. Return only the email body."
+        )
+        self._reply_system_prompt = (
+            f"{shared_prompt}\n\n"
+            "Task: a prospect replied to your cold email. Generate a helpful, professional "
+            "response that continues the conversation.\n\n"
+            "Write a response that:\n"
+            "1. Acknowledges their reply\n"
+            "2. Provides helpful information\n"
+            "3. Moves the conversation forward\n"
+            "4. Includes a clear next step\n\n"
+            "Keep it conversational and under 200 words."
+        )
+        
+        # Headers shared by every outgoing email (Reply-To for webhook handling)
+        self._header_prefix = (
+            f"From: {self.email_address}\r\n"
+            f"Reply-To: {self.email_address}\r\n"
+            "MIME-Version: 1.0\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+        )
+        
+        # Pool of persistent SMTP sessions, created on first send
+        self._smtp_pool = None
+        
+        # Persistent IMAP connection for reply monitoring
+        self._imap = None
+        
+        # Conversation memory: chat turns per prospect, persisted in SQLite
+        # (WAL mode so the reply monitor and webhook workers don't block
+        # each other); least recently active conversations evicted first
+        # All DB work runs on one dedicated thread: it keeps blocking SQLite
+        # calls (and lock waits) off the event loop and serialises use of
+        # the shared connection
+        self._db_executor = ThreadPoolExecutor(max_workers=1)
+        self.db = sqlite3.connect(
+            os.environ.get('CONVERSATIONS_DB', 'conversations.db'),
+            check_same_thread=False,
+            isolation_level=None
+        )
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS conversations '
+            '(email TEXT PRIMARY KEY, history TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at)'
+        )
         
         print("✅ Simple SDR initialized successfully")
     
-    def generate_cold_email(self, persona: str, recipient: str = "CEO") -> str:
+    async def _draft_pitches(self, personas: List[str], recipient: str) -> Dict:
         """
-        Generate a cold email using OpenAI with different personas.
+        Write a short pitch per persona, pick the best and write its subject
+        line, all in a single structured OpenAI call.
         
         Args:
-            persona: "professional", "engaging", or "concise"
+            personas: Keys of PERSONAS
             recipient: Target recipient title
             
         Returns:
-            Generated email content
+            Dict with "pitches" (in persona order), "best_index" and "subject"
         """
-        personas = {
-            "professional": "Write a professional, formal cold sales email",
-            "engaging": "Write a witty, engaging cold sales email that's likely to get a response", 
-            "concise": "Write a brief, direct cold sales email that gets straight to the point"
-        }
+        prompt = f"Personas: {', '.join(personas)}\nRecipient: {recipient}"
         
-        prompt = f"""
-        {personas.get(persona, personas["professional"])}.
+        fallback = {
+            "angle": self.company_description,
+            "hook": f"I'd love to show you how {self.company_name} can help."
+        }
         
-        Company: {self.company_name}
-        Product: {self.company_description}
-        Recipient: {recipient}
+        try:
+            response = await self.aclient.chat.completions.create(
+                model="gpt-4o-mini",  # Cheapest model with structured outputs
+                messages=[
+                    {"role": "system", "content": self._pitch_system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=80 * len(personas) + 50,
+                temperature=0.7,
+                response_format={"type": "json_schema", "json_schema": CAMPAIGN_PITCH_SCHEMA}
+            )
+            result = json.loads(response.choices[0].message.content)
+            by_persona = {p["persona"]: p for p in result["pitches"]}
+            pitches = [
+                {"persona": p, **by_persona.get(p, fallback)} for p in personas
+            ]
+            best_index = min(max(result["best_index"], 0), len(pitches) - 1)
+            subject = result["subject"].strip().replace('"', '')
+            return {"pitches": pitches, "best_index": best_index, "subject": subject}
+        except Exception as e:
+            print(f"❌ Error drafting pitches: {e}")
+            return {
+                "pitches": [{"persona": p, **fallback} for p in personas],
+                "best_index": 0,
+                "subject": f"Quick question about {self.company_name}"
+            }
+    
+    async def _expand_pitch(self, pitch: Dict, recipient: str) -> str:
+        """
+        Expand a single pitch into the full cold email.
         
-        Make it compelling and personalized. Include a clear call to action.
-        Keep it under 150 words.
+        Args:
+            pitch: Pitch with "persona", "angle" and "hook"
+            recipient: Target recipient title
+            
+        Returns:
+            Generated email content
         """
+        prompt = (
+            f"Persona: {pitch['persona']}\n"
+            f"Angle: {pitch['angle']}\n"
+            f"Hook: {pitch['hook']}\n"
+            f"Recipient: {recipient}"
+        )
         
         try:
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",  # Cheaper than gpt-4
-                messages=[{"role": "user", "content": prompt}],
+            response = await self.draft_client.chat.completions.create(
+                model=self.draft_model,
+                messages=[
+                    {"role": "system", "content": self._expand_system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
                 max_tokens=300,
-                temperature=0.7
+                temperature=0.7,
+                **self.draft_sampling
             )
             return response.choices[0].message.content.strip()
         except Exception as e:
             print(f"❌ Error generating email: {e}")
             return f"Hi {recipient},\n\nI'd love to show you how {self.company_name} can help with {self.company_description}.\n\nInterested in a quick chat?\n\nBest regards"
     
-    def select_best_email(self, emails: List[str]) -> str:
+    async def draft_campaign_email(self, personas: List[str], recipient: str = "CEO") -> Dict:
         """
-        Use AI to select the best email from generated options.
+        Draft the campaign email in two steps: short pitches for every
+        persona (with selection and subject line), then a full email for
+        the winning pitch only.
         
         Args:
-            emails: List of email content options
+            personas: Keys of PERSONAS
+            recipient: Target recipient title
             
         Returns:
-            Selected best email
+            Dict with "pitches" (in persona order), "best_index", "subject"
+            and the expanded "email"
         """
-        prompt = f"""
-        Pick the best cold sales email from these options. Consider which one a busy executive would be most likely to respond to.
-        
-        Return only the selected email, no explanation.
-        
-        Options:
-        
-        1. {emails[0]}
-        
-        2. {emails[1]}
-        
-        3. {emails[2]}
+        result = await self._draft_pitches(personas, recipient)
+        result["email"] = await self._expand_pitch(result["pitches"][result["best_index"]], recipient)
+        return result
+    
+    def _smtp_sessions(self) -> asyncio.Queue:
         """
+        Return the SMTP session pool, creating it on first use.
         
+        The pool starts with SMTP_POOL_SIZE empty slots; sessions are opened
+        lazily the first time a slot is borrowed. Slots are handed out
+        most-recently-returned first so warm sessions are reused before
+        empty ones.
+        """
+        if self._smtp_pool is None:
+            self._smtp_pool = asyncio.LifoQueue()
+            for _ in range(SMTP_POOL_SIZE):
+                self._smtp_pool.put_nowait(None)
+        return self._smtp_pool
+    
+    async def _warm_smtp(self):
+        """Open (or revive) a pooled SMTP session ahead of the next send."""
+        pool = self._smtp_sessions()
+        smtp = await pool.get()
         try:
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=400,
-                temperature=0.3
-            )
-            return response.choices[0].message.content.strip()
+            smtp = await self._ensure_smtp(smtp)
         except Exception as e:
-            print(f"❌ Error selecting email: {e}")
-            return emails[0]  # Fallback to first email
+            # The send itself will retry the connection and report the error
+            print(f"⚠️  SMTP warm-up failed: {e}")
+            smtp = None
+        finally:
+            pool.put_nowait(smtp)
+    
+    async def _ensure_smtp(self, smtp: Optional[aiosmtplib.SMTP]) -> aiosmtplib.SMTP:
+        """
+        Return a live SMTP session, reconnecting only if it has dropped.
+        
+        Args:
+            smtp: Session borrowed from the pool, or None for an empty slot
+            
+        Returns:
+            Connected and authenticated SMTP session
+        """
+        if smtp is not None:
+            try:
+                response = await smtp.noop()
+                if response.code == 250:
+                    return smtp
+            except aiosmtplib.SMTPException:
+                pass
+            smtp.close()
+        
+        smtp = aiosmtplib.SMTP(hostname=self.smtp_server, port=self.smtp_port, start_tls=True)
+        try:
+            await smtp.connect()
+            await smtp.login(self.email_address, self.email_password)
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
     
-    def send_email_smtp(self, to_email: str, subject: str, body: str) -> bool:
+    async def send_email_smtp(self, to_email: str, subject: str, body: str) -> bool:
         """
         Send email using free SMTP service (Gmail/Outlook).
         
+        Each send borrows a session from a small pool so concurrent sends
+        run in parallel; sessions (TLS + login) are reused across sends and
+        only re-established after they drop.
+        
         Args:
             to_email: Recipient email address
             subject: Email subject
@@ -165,24 +405,45 @@ class SimpleSDR:
             True if sent successfully, False otherwise
         """
         try:
-            # Create message
-            msg = MIMEMultipart()
-            msg['From'] = self.email_address
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            
-            # Add reply-to header for webhook handling
-            msg['Reply-To'] = self.email_address
+            # Create message from the precomputed header block; only the
+            # per-message headers and body are formatted here
+            to_email = to_email.replace('\r', '').replace('\n', '')
+            to_header = formataddr(parseaddr(to_email), 'utf-8')
+            subject = ' '.join(subject.splitlines())
+            if not subject.isascii():
+                subject = Header(subject, 'utf-8').encode()
+            body = body.replace('\r\n', '\n').replace('\n', '\r\n')
+            headers = f"{self._header_prefix}To: {to_header}\r\nSubject: {subject}\r\n"
             
-            msg.attach(MIMEText(body, 'plain'))
-            
-            # Send via SMTP
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.email_address, self.email_password)
-            text = msg.as_string()
-            server.sendmail(self.email_address, to_email, text)
-            server.quit()
+            # Send via a pooled SMTP session, within the provider's rate limit
+            async with self.send_limiter:
+                pool = self._smtp_sessions()
+                smtp = await pool.get()
+                try:
+                    smtp = await self._ensure_smtp(smtp)
+                    
+                    # Send non-ASCII bodies as 8bit only where the server
+                    # advertises 8BITMIME (RFC 6152); otherwise quoted-printable
+                    mail_options = []
+                    if body.isascii():
+                        encoding, payload = '7bit', body
+                    elif smtp.supports_extension('8BITMIME'):
+                        encoding, payload = '8bit', body
+                        mail_options = ['BODY=8BITMIME']
+                    else:
+                        encoding = 'quoted-printable'
+                        payload = quoprimime.body_encode(body.encode('utf-8').decode('latin-1'), eol='\r\n')
+                    message = f"{headers}Content-Transfer-Encoding: {encoding}\r\n\r\n{payload}".encode('utf-8')
+                    
+                    await smtp.sendmail(self.email_address, [to_email], message, mail_options=mail_options)
+                except Exception:
+                    # Drop the session so the next borrower of this slot reconnects
+                    if smtp is not None:
+                        smtp.close()
+                    smtp = None
+                    raise
+                finally:
+                    pool.put_nowait(smtp)
             
             print(f"✅ Email sent successfully to {to_email}")
             return True
@@ -195,100 +456,211 @@ class SimpleSDR:
             print("   • Verify email/password in .env file")
             return False
     
-    def generate_reply(self, original_email: str, reply_content: str) -> str:
+    async def generate_reply(self, history: List[Dict], reply_content: str) -> str:
         """
         Generate an AI reply to continue the conversation.
         
         Args:
-            original_email: The original cold email sent
+            history: Earlier turns as chat messages (our emails are
+                "assistant", the prospect's replies are "user")
             reply_content: The prospect's reply content
             
         Returns:
             Generated reply email
         """
-        prompt = f"""
-        You are a sales representative for {self.company_name}, which provides {self.company_description}.
-        
-        A prospect replied to your cold email. Generate a helpful, professional response that continues the conversation.
-        
-        Original email you sent:
-        {original_email}
-        
-        Their reply:
-        {reply_content}
-        
-        Write a response that:
-        1. Acknowledges their reply
-        2. Provides helpful information
-        3. Moves the conversation forward
-        4. Includes a clear next step
-        
-        Keep it conversational and under 200 words.
-        """
-        
         try:
-            response = openai.chat.completions.create(
+            stream = await self.aclient.chat.completions.create(
                 model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
+                messages=[
+                    {"role": "system", "content": self._reply_system_prompt},
+                    *history,
+                    {"role": "user", "content": reply_content}
+                ],
                 max_tokens=400,
-                temperature=0.7
+                temperature=0.7,
+                stream=True
             )
-            return response.choices[0].message.content.strip()
+            parts = []
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+            return "".join(parts).strip()
         except Exception as e:
             print(f"❌ Error generating reply: {e}")
             return "Thank you for your reply! I'd love to continue our conversation. When would be a good time for a brief call?"
     
-    def check_for_replies(self):
+    async def _run_imap(self, func, *args):
+        """Run a blocking IMAP call in the executor so the event loop stays free."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+    
+    async def check_for_replies(self, client: IMAPClient):
+        """
+        Process unread replies on an open IMAP connection.
+        
+        Args:
+            client: Logged-in IMAP client with INBOX selected
+        """
+        # Search for unread emails and fetch them all in one command.
+        # BODY.PEEK[] leaves \Seen alone, so only replies that were actually
+        # handled get marked read below.
+        msg_ids = await self._run_imap(client.search, 'UNSEEN')
+        if not msg_ids:
+            return
+        msg_data = await self._run_imap(client.fetch, msg_ids, ['BODY.PEEK[]'])
+        
+        processed = []
+        try:
+            for msg_id in msg_ids:
+                if msg_id not in msg_data:
+                    continue
+                
+                email_body = msg_data[msg_id][b'BODY[]']
+                email_message = email.message_from_bytes(email_body, policy=email.policy.default)
+                
+                from_email = email_message['From']
+                subject = email_message['Subject'] or ""
+                
+                # Get email content, decoded with the part's declared charset
+                body_part = email_message.get_body(preferencelist=('plain', 'html'))
+                body = body_part.get_content() if body_part is not None else ""
+                
+                print(f"📧 New reply from {from_email}: {subject}")
+                
+                # Process the reply; a failure leaves it unread for the next
+                # pass without holding up the rest of the batch
+                try:
+                    await self.handle_reply(from_email, subject, body)
+                except Exception as e:
+                    print(f"❌ Error handling reply from {from_email}: {e}")
+                    continue
+                processed.append(msg_id)
+        finally:
+            # Mark everything handled as read in one command
+            if processed:
+                await self._run_imap(client.add_flags, processed, [SEEN])
+    
+    def _ensure_imap(self) -> IMAPClient:
+        """
+        Return the cached IMAP connection, reconnecting only if it has dropped.
+        
+        Returns:
+            Logged-in IMAP client with INBOX selected
+        """
+        if self._imap is not None:
+            try:
+                self._imap.noop()
+                return self._imap
+            except Exception:
+                self._drop_imap()
+        
+        client = IMAPClient(self.imap_server, ssl=True)
+        try:
+            client.login(self.email_address, self.email_password)
+            client.select_folder('INBOX')
+        except Exception:
+            client.shutdown()
+            raise
+        self._imap = client
+        return client
+    
+    def _drop_imap(self):
+        """Close the cached IMAP connection so the next use reconnects."""
+        if self._imap is not None:
+            try:
+                self._imap.shutdown()
+            except Exception:
+                pass
+            self._imap = None
+    
+    async def watch_for_replies(self):
         """
-        Check email inbox for replies using IMAP (free).
-        This runs as a background process.
+        Watch the inbox for replies using IMAP IDLE (free).
+        
+        Keeps one connection open and lets the server push new-mail
+        notifications instead of polling. Servers without IDLE are polled
+        on the same cached connection. Runs until the connection fails.
         """
         try:
-            # Connect to IMAP server
-            mail = imaplib.IMAP4_SSL(self.imap_server)
-            mail.login(self.email_address, self.email_password)
-            mail.select('inbox')
+            client = await self._run_imap(self._ensure_imap)
             
-            # Search for unread emails
-            status, messages = mail.search(None, 'UNSEEN')
+            # Pick up anything that arrived before we started watching
+            await self.check_for_replies(client)
             
-            if status == 'OK':
-                for msg_id in messages[0].split():
-                    # Fetch email
-                    status, msg_data = mail.fetch(msg_id, '(RFC822)')
-                    
-                    if status == 'OK':
-                        email_body = msg_data[0][1]
-                        email_message = email.message_from_bytes(email_body)
-                        
-                        from_email = email_message['From']
-                        subject = email_message['Subject']
-                        
-                        # Get email content
-                        body = ""
-                        if email_message.is_multipart():
-                            for part in email_message.walk():
-                                if part.get_content_type() == "text/plain":
-                                    body = part.get_payload(decode=True).decode()
-                                    break
-                        else:
-                            body = email_message.get_payload(decode=True).decode()
-                        
-                        print(f"📧 New reply from {from_email}: {subject}")
-                        
-                        # Process the reply
-                        self.handle_reply(from_email, subject, body)
-                        
-                        # Mark as read
-                        mail.store(msg_id, '+FLAGS', '\\Seen')
-            
-            mail.close()
-            mail.logout()
+            if await self._run_imap(client.has_capability, 'IDLE'):
+                while True:
+                    # Wake on any server push or the re-IDLE timeout, then
+                    # check the inbox every time: a cheap SEARCH UNSEEN also
+                    # catches mail whose EXISTS arrived while leaving IDLE
+                    # or while the previous batch was being handled
+                    await self._run_imap(client.idle)
+                    await self._run_imap(client.idle_check, IMAP_IDLE_TIMEOUT)
+                    await self._run_imap(client.idle_done)
+                    await self.check_for_replies(client)
+            else:
+                while True:
+                    await asyncio.sleep(IMAP_POLL_INTERVAL)
+                    client = await self._run_imap(self._ensure_imap)
+                    await self.check_for_replies(client)
+        except (Exception, asyncio.CancelledError):
+            # Closing the socket also unblocks an IDLE wait in the executor
+            self._drop_imap()
+            raise
+    
+    @staticmethod
+    def _conversation_key(address: str) -> str:
+        """Normalise an address or From header ("Name <a@b.com>") to a key."""
+        return (parseaddr(address)[1] or address).lower()
+    
+    async def _run_db(self, func, *args):
+        """Run a blocking conversation-store call on the DB thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, func, *args)
+    
+    def _history(self, conversation_key: str) -> List[Dict]:
+        """
+        Load a conversation's chat turns.
+        
+        Args:
+            conversation_key: Normalised prospect address
             
-        except Exception as e:
-            print(f"❌ Error checking replies: {e}")
+        Returns:
+            Chat messages so far, or an empty list for a new prospect
+        """
+        row = self.db.execute(
+            'SELECT history FROM conversations WHERE email = ?', (conversation_key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else []
+    
+    def _remember(self, conversation_key: str, *turns: Dict):
+        """
+        Append turns to a conversation, evicting the least recently active
+        conversations once MAX_CONVERSATIONS is exceeded.
+        
+        Args:
+            conversation_key: Normalised prospect address
+            turns: Chat messages to append
+        """
+        # IMMEDIATE takes the write lock up front so concurrent writers
+        # (other webhook workers) can't interleave the read-modify-write
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            history = self._history(conversation_key) + list(turns)
+            self.db.execute(
+                'INSERT OR REPLACE INTO conversations (email, history, updated_at) VALUES (?, ?, ?)',
+                (conversation_key, json.dumps(history), time.time())
+            )
+            self.db.execute(
+                'DELETE FROM conversations WHERE email IN '
+                '(SELECT email FROM conversations ORDER BY updated_at DESC LIMIT -1 OFFSET ?)',
+                (MAX_CONVERSATIONS,)
+            )
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
     
-    def handle_reply(self, from_email: str, subject: str, body: str):
+    async def handle_reply(self, from_email: str, subject: str, body: str):
         """
         Handle incoming email reply by generating and sending AI response.
         
@@ -300,114 +672,127 @@ class SimpleSDR:
         print(f"🤖 Processing reply from {from_email}")
         
         # Get conversation history
-        conversation_key = from_email.lower()
-        original_email = self.conversations.get(conversation_key, "")
+        conversation_key = self._conversation_key(from_email)
+        history = await self._run_db(self._history, conversation_key)
         
-        # Generate AI reply
-        reply = self.generate_reply(original_email, body)
+        # Generate AI reply while an SMTP session is connected in parallel
+        warmup = asyncio.ensure_future(self._warm_smtp())
+        reply = await self.generate_reply(history, body)
+        await warmup
         
         # Send reply
         reply_subject = f"Re: {subject}" if not subject.startswith('Re:') else subject
-        success = self.send_email_smtp(from_email, reply_subject, reply)
+        success = await self.send_email_smtp(from_email, reply_subject, reply)
         
         if success:
-            # Update conversation history
-            self.conversations[conversation_key] = f"{original_email}\n\n--- THEIR REPLY ---\n{body}\n\n--- MY REPLY ---\n{reply}"
+            # Update conversation history; the reply is already sent, so a
+            # storage error must not fail the reply and get it re-sent
+            try:
+                await self._run_db(
+                    self._remember,
+                    conversation_key,
+                    {"role": "user", "content": body},
+                    {"role": "assistant", "content": reply}
+                )
+            except Exception as e:
+                print(f"❌ Error saving conversation with {from_email}: {e}")
             print(f"✅ Auto-reply sent to {from_email}")
         else:
             print(f"❌ Failed to send auto-reply to {from_email}")
     
-    async def run_cold_email_campaign(self, recipients: List[str]):
+    async def process_recipient(self, recipient: str):
+        """
+        Draft, select and send the campaign email for a single recipient.
+        
+        Args:
+            recipient: Email address to send to
+        """
+        print(f"\n📧 Processing recipient: {recipient}")
+        
+        # Step 1: Pitch every persona, select the best with its subject line,
+        # then write the full email for that pitch only
+        print(f"   🎭 Generating emails with different personas for {recipient}...")
+        personas = list(self.PERSONAS)
+        result = await self.draft_campaign_email(personas)
+        best_email = result["email"]
+        subject = result["subject"]
+        print(f"   🎯 Selected {personas[result['best_index']]} email for {recipient}")
+        print(f"   📝 Subject: {subject}")
+        
+        # Step 2: Send email (throttled by send_limiter to avoid spam detection)
+        print(f"   📤 Sending email to {recipient}...")
+        success = await self.send_email_smtp(recipient, subject, best_email)
+        
+        if success:
+            # Store conversation for reply handling; the email is already
+            # sent, so a storage error is logged rather than raised
+            try:
+                await self._run_db(
+                    self._remember,
+                    self._conversation_key(recipient),
+                    {"role": "assistant", "content": best_email}
+                )
+            except Exception as e:
+                print(f"   ❌ Error saving conversation with {recipient}: {e}")
+            print(f"   ✅ Campaign email sent to {recipient}")
+        else:
+            print(f"   ❌ Failed to send to {recipient}")
+    
+    async def run_cold_email_campaign(self, recipients: List[str], concurrency: int = CAMPAIGN_CONCURRENCY):
         """
         Run a complete cold email campaign.
         
+        Recipients are processed concurrently (up to `concurrency` at a time)
+        while sends are capped by the SMTP provider's rate limit.
+        
         Args:
             recipients: List of email addresses to send to
+            concurrency: Maximum number of recipients processed at once
         """
         print("🚀 Starting Cold Email Campaign...")
         print("=" * 50)
         
-        for recipient in recipients:
-            print(f"\n📧 Processing recipient: {recipient}")
-            
-            # Step 1: Generate multiple email options
-            print("   🎭 Generating emails with different personas...")
-            emails = []
-            personas = ["professional", "engaging", "concise"]
-            
-            for persona in personas:
-                email_content = self.generate_cold_email(persona)
-                emails.append(email_content)
-                print(f"      ✅ {persona.title()} email generated")
-            
-            # Step 2: Select best email
-            print("   🎯 Selecting best email...")
-            best_email = self.select_best_email(emails)
-            
-            # Step 3: Generate subject line
-            subject_prompt = f"Write a compelling email subject line for this cold sales email:\n\n{best_email}\n\nMake it likely to get opened. Under 50 characters."
-            
-            try:
-                subject_response = openai.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": subject_prompt}],
-                    max_tokens=50,
-                    temperature=0.7
-                )
-                subject = subject_response.choices[0].message.content.strip().replace('"', '')
-            except:
-                subject = f"Quick question about {self.company_name}"
-            
-            print(f"   📝 Subject: {subject}")
-            
-            # Step 4: Send email
-            print("   📤 Sending email...")
-            success = self.send_email_smtp(recipient, subject, best_email)
-            
-            if success:
-                # Store conversation for reply handling
-                self.conversations[recipient.lower()] = best_email
-                print(f"   ✅ Campaign email sent to {recipient}")
-            else:
-                print(f"   ❌ Failed to send to {recipient}")
-            
-            # Add delay between emails to avoid spam detection
-            print("   ⏱️  Waiting 30 seconds before next email...")
-            await asyncio.sleep(30)
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def run_one(recipient: str):
+            async with semaphore:
+                await self.process_recipient(recipient)
+        
+        await asyncio.gather(*(run_one(r) for r in recipients))
         
         print("\n🎊 Cold email campaign completed!")
         print("📬 Monitoring for replies... (Press Ctrl+C to stop)")
     
-    def start_reply_monitoring(self):
-        """Start monitoring for email replies in background."""
-        def monitor():
-            while True:
-                try:
-                    self.check_for_replies()
-                    time.sleep(60)  # Check every minute
-                except KeyboardInterrupt:
-                    break
-                except Exception as e:
-                    print(f"❌ Reply monitoring error: {e}")
-                    time.sleep(60)
-        
-        # Start monitoring in background thread
-        monitor_thread = Thread(target=monitor, daemon=True)
-        monitor_thread.start()
-        return monitor_thread
+    async def monitor_replies(self):
+        """Monitor for email replies on the running event loop, reconnecting after errors."""
+        while True:
+            try:
+                await self.watch_for_replies()
+            except Exception as e:
+                print(f"❌ Reply monitoring error: {e}")
+                await asyncio.sleep(60)  # Wait before reconnecting
+
 
+# Webhook server for advanced reply handling (alternative to IMAP monitoring)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create one SDR per server worker, shared by all requests."""
+    # One SDR for the server's lifetime so its OpenAI client and SMTP
+    # sessions are reused across requests
+    app.state.sdr = SimpleSDR()
+    yield
 
-# Webhook server for advanced reply handling (alternative to IMAP polling)
-app = Flask(__name__)
 
-@app.route('/webhook/email-reply', methods=['POST'])
-def handle_webhook_reply():
+app = FastAPI(lifespan=lifespan)
+
+@app.post('/webhook/email-reply')
+async def handle_webhook_reply(request: Request, background_tasks: BackgroundTasks):
     """
     Handle email replies via webhook (for advanced setup).
-    This can be used instead of IMAP polling for real-time replies.
+    This can be used instead of IMAP monitoring for real-time replies.
     """
     try:
-        data = request.json
+        data = await request.json()
         
         # Extract email data (format depends on your email service webhook)
         from_email = data.get('from')
@@ -416,22 +801,40 @@ def handle_webhook_reply():
         
         print(f"📨 Webhook reply from {from_email}: {subject}")
         
-        # Initialize SDR and handle reply
-        sdr = SimpleSDR()
-        sdr.handle_reply(from_email, subject, body)
+        # Handle the reply after responding so the webhook caller gets an
+        # immediate response
+        background_tasks.add_task(
+            _process_webhook_reply, request.app.state.sdr, from_email, subject, body
+        )
         
-        return jsonify({"status": "success", "message": "Reply processed"})
+        return JSONResponse({"status": "queued", "message": "Reply queued for processing"}, status_code=202)
         
     except Exception as e:
         print(f"❌ Webhook error: {e}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+
+async def _process_webhook_reply(sdr: SimpleSDR, from_email: str, subject: str, body: str):
+    """Handle a queued webhook reply, logging any failure."""
+    try:
+        await sdr.handle_reply(from_email, subject, body)
+    except Exception as e:
+        print(f"❌ Queued reply failed: {e}")
 
 
 def run_webhook_server():
     """Run the webhook server for handling email replies."""
+    workers = int(os.environ.get('WEBHOOK_WORKERS', '1'))
+    
     print("🌐 Starting webhook server on http://localhost:5000")
     print("💡 Use ngrok to expose this publicly: ngrok http 5000")
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    uvicorn.run(
+        f"{os.path.splitext(os.path.basename(__file__))[0]}:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host='0.0.0.0',
+        port=5000,
+        workers=workers
+    )
 
 
 async def main():
@@ -459,7 +862,7 @@ async def main():
         
         # Test email sending
         print("\n📤 Testing email configuration...")
-        test_success = sdr.send_email_smtp(
+        test_success = await sdr.send_email_smtp(
             sdr.email_address,  # Send test to yourself
             "Test - Simple SDR System",
             "This is a test email from your Simple SDR system. If you receive this, email sending is working!"
@@ -473,18 +876,16 @@ async def main():
         
         # Demo: Generate sample emails
         print("\n🎭 Demo: Generating sample emails...")
-        sample_emails = []
-        for persona in ["professional", "engaging", "concise"]:
-            email = sdr.generate_cold_email(persona, "Startup CEO")
-            sample_emails.append(email)
-            print(f"\n--- {persona.upper()} EMAIL ---")
-            print(email[:200] + "..." if len(email) > 200 else email)
-        
-        # Demo: Select best email
-        print(f"\n🎯 Demo: AI selecting best email...")
-        best = sdr.select_best_email(sample_emails)
-        print("--- SELECTED BEST EMAIL ---")
-        print(best)
+        personas = list(sdr.PERSONAS)
+        sample = await sdr.draft_campaign_email(personas, "Startup CEO")
+        for pitch in sample["pitches"]:
+            print(f"\n--- {pitch['persona'].upper()} PITCH ---")
+            print(f"{pitch['angle']}: {pitch['hook']}")
+        
+        # Demo: Best pitch, expanded into the full email
+        print(f"\n🎯 Demo: AI selected best email...")
+        print(f"--- SELECTED BEST EMAIL ({sample['subject']}) ---")
+        print(sample["email"])
         
         # Ask user for campaign
         print("\n" + "="*60)
@@ -507,12 +908,11 @@ async def main():
         
         # Start reply monitoring
         print("\n📬 Starting reply monitoring...")
-        sdr.start_reply_monitoring()
+        monitor_task = asyncio.create_task(sdr.monitor_replies())
         
         # Keep running
         print("🔄 System running... Press Ctrl+C to stop")
-        while True:
-            await asyncio.sleep(10)
+        await monitor_task
     
     except KeyboardInterrupt:
         print("\n👋 Simple SDR system stopped by user")